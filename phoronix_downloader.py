@@ -1,13 +1,28 @@
 #!/usr/bin/env python3
 
 from __future__ import annotations
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+import sys
 from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
     from typing import Literal, Optional
 
 PACKAGES_JSON_FILENAME = "packages.json"
+# Size, mtime and hash of the files verified by previous runs, see _file_stamp()
+VERIFIED_JSON_FILENAME = ".verified.json"
+# Directory of an opt-in, content-addressed cache through which verified packages are shared between
+# benchmarks. The cache is only used when this variable is set to a non-empty path.
+DOWNLOAD_CACHE_ENV = "PHORONIX_DOWNLOAD_CACHE"
+MAX_PARALLEL_DOWNLOADS = 8
+# Large enough to amortize the read/write syscalls over multi-GB packages
+COPY_BUFSIZE = 1 << 20
+# Seconds between two redraws of the progress bar
+PROGRESS_INTERVAL = 0.1
+_PLATFORM = sys.platform
+# dataclass(slots=True) is only available from Python 3.10 onwards
+_DATACLASS_SLOTS = {"slots": True} if sys.version_info >= (3, 10) else {}
 
 
 class ProgressBar:
@@ -15,7 +30,9 @@ class ProgressBar:
         from progressbar import Bar, ETA, FileTransferSpeed, Percentage, UnknownLength
 
         self.pbar = None
+        self.update = None
         self.total_size = total_size if total_size > 0 else UnknownLength
+        self.known_size = self.total_size != UnknownLength
         self.widgets = [
             Percentage() if total_size else " ",
             Bar(),
@@ -28,24 +45,32 @@ class ProgressBar:
         ]
 
     def call(self, block_num, block_size):
-        from progressbar import ProgressBar, UnknownLength
-
         if not self.pbar:
+            from progressbar import ProgressBar
+
             self.pbar = ProgressBar(maxval=self.total_size, widgets=self.widgets)
             self.pbar.start()
+            self.update = self.pbar.update
 
         downloaded = block_num * block_size
 
-        if self.total_size == UnknownLength:
-            self.pbar.update(downloaded)
+        if not self.known_size or downloaded < self.total_size:
+            self.update(downloaded)
         else:
-            if downloaded < self.total_size:
-                self.pbar.update(downloaded)
-            else:
-                self.pbar.finish()
+            self.pbar.finish()
+
+
+class SilentProgressBar:
+    """
+    A ProgressBar stand-in which draws nothing,
+    used while downloading concurrently or when stderr isn't a terminal.
+    """
+
+    def call(self, block_num, block_size):
+        pass
 
 
-@dataclass
+@dataclass(**_DATACLASS_SLOTS)
 class PhoronixDownloadDefinition:
     filename: str
     platform: Optional[Literal["darwin", "linux", "windows"]]
@@ -69,131 +94,393 @@ class PhoronixDownloadDefinition:
         from json import dump
 
         with open(filename, "w") as file:
-            dump([package.__dict__ for package in packages], file)
+            dump([asdict(package) for package in packages], file)
 
     def __repr__(self) -> str:
         return (
             f"{self.filename} (platform={self.platform}, "
-            f"{'md5' if self.md5 else 'sha256' if self.sha256 else 'size' if self.size else 'noverify'}"
-            f"={self.md5 or self.sha256 or self.size or '1'})"
+            f"{'sha256' if self.sha256 else 'md5' if self.md5 else 'size' if self.size else 'noverify'}"
+            f"={self.sha256 or self.md5 or self.size or '1'})"
         )
 
 
-def mycopyfileobj(fsrc, fdst, length=0, total_size=0, prog_bar: ProgressBar = None):
-    """copy data from file-like object fsrc to file-like object fdst"""
-    from shutil import COPY_BUFSIZE
+def _hash_file(path, hash_name) -> str:
+    """hash the file at path with the hash_name algorithm (e.g. "md5"), without reading it into memory"""
+    with open(path, "rb", buffering=0) as f:
+        if sys.version_info >= (3, 11):
+            from hashlib import file_digest
+
+            # The read/update loop runs entirely in C
+            return file_digest(f, hash_name).hexdigest()
+
+        from hashlib import new
+        from mmap import ACCESS_READ, mmap
+        from os import fstat
+
+        h = new(hash_name)
+        # Empty files can't be mapped
+        if fstat(f.fileno()).st_size:
+            # Hash straight from the page cache, without copying the file through read() buffers
+            with mmap(f.fileno(), 0, access=ACCESS_READ) as mm:
+                h.update(mm)
+        return h.hexdigest()
+
+
+def mycopyfileobj(fsrc, fdst, length=0, total_size=0, prog_bar: ProgressBar = None, hasher=None):
+    """copy data from file-like object fsrc to file-like object fdst, feeding hasher (if any) on the way"""
+    from time import monotonic
+
+    if not length:
+        length = COPY_BUFSIZE
+    if not hasher and isinstance(prog_bar, SilentProgressBar):
+        from shutil import copyfileobj
+
+        # Nothing to do besides copying: let shutil run the loop
+        copyfileobj(fsrc, fdst, length)
+        return
 
     # Localize variable access to minimize overhead.
     if not prog_bar:
         prog_bar = ProgressBar(total_size)
-    if not length:
-        length = COPY_BUFSIZE
     fsrc_read = fsrc.read
     fdst_write = fdst.write
-    block_num = 0
+    hasher_update = hasher.update if hasher else None
+    prog_bar_call = prog_bar.call
+    # Redraw the progress bar at most every PROGRESS_INTERVAL seconds, however fast the transfer is
+    next_draw = 0.0
+    drawn_block = block_num = 0
     while True:
-        block_num += 1
         buf = fsrc_read(length)
         if not buf:
             break
+        block_num += 1
         fdst_write(buf)
-        prog_bar.call(block_num=block_num, block_size=length)
+        if hasher_update:
+            hasher_update(buf)
+        now = monotonic()
+        if now >= next_draw:
+            prog_bar_call(block_num=block_num, block_size=length)
+            drawn_block = block_num
+            next_draw = now + PROGRESS_INTERVAL
+    if drawn_block != block_num:
+        prog_bar_call(block_num=block_num, block_size=length)
+
+
+@lru_cache(maxsize=1)
+def http_session():
+    """
+    The HTTP session shared by all downloads: connections (and TLS sessions) are kept alive and
+    reused across packages and mirrors instead of being set up again for every URL.
+    """
+    from requests import Session
+    from requests.adapters import HTTPAdapter
 
+    session = Session()
+    # requests asks for gzip/deflate by default: a mirror applying a Content-Encoding would then send bytes
+    # which don't match the checksums. Ask for the file as is, so that r.raw can be saved without decoding.
+    session.headers["Accept-Encoding"] = "identity"
+    adapter = HTTPAdapter(pool_connections=MAX_PARALLEL_DOWNLOADS, pool_maxsize=MAX_PARALLEL_DOWNLOADS)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
 
-def download_file(url, target_filename):
-    from requests import get
 
-    with get(url, stream=True) as r:
+def download_file(url, target_filename, hasher=None, prog_bar: ProgressBar = None, expected_size=None) -> bool:
+    """
+    download url into target_filename, feeding hasher (if any) with the whole file.
+    A target_filename shorter than expected_size is taken as an interrupted download and resumed with
+    a Range request; if the server doesn't resume it exactly where it stopped, it is downloaded again from the start.
+    Error replies raise before target_filename is touched, so a partial file survives for the next mirror.
+    Returns whether the kept partial file was reused: if the result doesn't verify, the prefix may be stale.
+    """
+    from os.path import getsize, isfile
+
+    def hash_existing():
+        # The checksum covers the whole file, including the part downloaded earlier
+        with open(target_filename, "rb") as f:
+            for buf in iter(lambda: f.read(COPY_BUFSIZE), b""):
+                hasher.update(buf)
+
+    def save(r, mode):
         try:
             total_size = int(r.headers.get("Content-Length"))
         except Exception:
             total_size = 0
-        with open(target_filename, "wb") as f:
-            mycopyfileobj(r.raw, f, total_size=total_size)
+        with open(target_filename, mode) as f:
+            mycopyfileobj(r.raw, f, total_size=total_size, prog_bar=prog_bar, hasher=hasher)
+
+    offset = 0
+    if expected_size and isfile(target_filename) and getsize(target_filename) < expected_size:
+        offset = getsize(target_filename)
+
+    # r.raw is deliberately not decoded: http_session() asks for the file as is, which is what the checksums cover
+    if offset:
+        with http_session().get(url, stream=True, timeout=30, headers={"Range": f"bytes={offset}-"}) as r:
+            if r.status_code == 416:
+                # Nothing past offset: the file may already be complete, with a stale declared size
+                print(f"{target_filename} may already be complete, verifying it.")
+                if hasher:
+                    hash_existing()
+                return True
+            r.raise_for_status()
+            if r.status_code == 206 and r.headers.get("Content-Range", "").startswith(f"bytes {offset}-"):
+                if hasher:
+                    hash_existing()
+                save(r, "ab")
+                return True
+            if r.status_code == 200:
+                # The server ignored the Range header and sent the whole file
+                save(r, "wb")
+                return False
+            print(f"Unusable reply to the Range request for {url}, downloading it from the start.")
+
+    with http_session().get(url, stream=True, timeout=30) as r:
+        r.raise_for_status()
+        if r.status_code != 200:
+            raise Exception(f"Unexpected HTTP status {r.status_code} downloading {url}")
+        save(r, "wb")
+    return False
+
+
+def _file_stamp(path, hash) -> list:
+    """what identifies a verified file across runs: its size and mtime, and the hash it was checked against"""
+    from os import stat
+
+    st = stat(path)
+    return [st.st_size, st.st_mtime_ns, hash]
+
+
+def _cache_path(hash_name, hash):
+    """the path of the file with the given hash in the download cache, None if the cache is disabled"""
+    from os import environ
+    from os.path import join
+
+    cache_dir = environ.get(DOWNLOAD_CACHE_ENV)
+    return join(cache_dir, f"{hash_name}-{hash}") if cache_dir else None
+
+
+def _link_from_cache(cache_file, target_file, hash_name, hash) -> bool:
+    """hardlink the cached copy of a package to target_file, checking that the cached file is still intact"""
+    from contextlib import suppress
+    from os import link, remove
+    from os.path import isfile
+
+    if not isfile(cache_file):
+        return False
+
+    # Drop any partial download: the cached copy supersedes it
+    with suppress(FileNotFoundError):
+        remove(target_file)
+    try:
+        link(cache_file, target_file)
+    except OSError:
+        return False
+
+    if _hash_file(target_file, hash_name) == hash:
+        return True
+
+    print(f"Cached copy of {target_file} is corrupted, removing it.")
+    remove(target_file)
+    remove(cache_file)
+    return False
+
+
+def _store_in_cache(target_file, cache_file):
+    """add a verified download to the cache, without copying it: both names share the same file"""
+    from contextlib import suppress
+    from os import link, makedirs
+    from os.path import dirname
+
+    with suppress(OSError):
+        makedirs(dirname(cache_file) or ".", exist_ok=True)
+        link(target_file, cache_file)
+
+
+def _verify_existing_file(package: PhoronixDownloadDefinition, target_file, hash_name, hash) -> bool:
+    """check a file left by a previous run against its package definition"""
+    from os.path import getsize
+
+    # The size check is cheap: only hash files which have the expected size
+    if package.size and getsize(target_file) != package.size:
+        return False
+    if hash:
+        return _hash_file(target_file, hash_name) == hash
+    return getsize(target_file) == package.size
+
+
+def _verify_download(package: PhoronixDownloadDefinition, url, target_file, hasher) -> bool:
+    """check a file just downloaded from url against its package definition"""
+    from os.path import getsize
+
+    if hasher:
+        actual_hash = hasher.hexdigest()
+        verified = actual_hash == (package.sha256 or package.md5)
+        if not verified:
+            print(
+                f"Got wrong checksum downloading {package} from {url}, "
+                f"download hash: {actual_hash}"
+            )
+    elif package.size:
+        print("No hash specified, checking file size instead.")
+        actual_size = getsize(target_file)
+        verified = actual_size == package.size
+        if not verified:
+            print(
+                f"Got wrong filesize downloading {package} from {url}, "
+                f"download_size={actual_size}"
+            )
+    else:
+        print(
+            "WARN: No verification method available for package!\n"
+            f"Verification skipped for {target_file}"
+        )
+        verified = True
 
+    return verified
 
-def download_packages():
+
+def _download_and_verify(package: PhoronixDownloadDefinition, url, target_file, hash_name, hash, prog_bar) -> bool:
     """
-    A function which downloads the required software as described by get_download_packages().
-    It verifies the checksums afterwards.
+    download a package from url and verify it, removing the file if it doesn't pass.
+    A resumed download which doesn't pass is tried again from the start, as the kept prefix may be stale.
     """
-    from hashlib import md5, sha256
+    from hashlib import new
     from os import remove
-    from os.path import exists, isfile, getsize
-    from sys import platform
+
+    while True:
+        # Hash while streaming, so that the file doesn't need to be read back
+        hasher = new(hash_name) if hash else None
+        resumed = download_file(
+            url=url, target_filename=target_file, hasher=hasher, prog_bar=prog_bar, expected_size=package.size
+        )
+        if _verify_download(package, url, target_file, hasher):
+            return True
+
+        print(f"File {target_file} will now be removed.")
+        remove(target_file)
+        if not resumed:
+            return False
+        print(f"Downloading {target_file} again from the start.")
+
+
+def download_package(package: PhoronixDownloadDefinition, prog_bar: ProgressBar = None, stamp=None):
+    """
+    A function which downloads a single package, trying each of its URLs in turn until one
+    of them provides a file passing verification.
+    stamp is the _file_stamp() recorded when the file was last verified: if the file still matches it,
+    it isn't hashed again. The stamp of the verified file is returned (None for packages without a hash).
+    """
+    from os import remove, stat
+    from os.path import isfile
     from traceback import print_exc
 
-    if not exists(PACKAGES_JSON_FILENAME):
-        return
+    # SHA-256 is preferred when both are available: OpenSSL runs it on the SHA extensions of recent CPUs
+    hash = package.sha256 or package.md5
+    hash_name = "sha256" if package.sha256 else "md5" if package.md5 else None
+
+    print(f"Downloading {package}")
+
+    target_file = package.filename
+
+    if isfile(target_file):
+        if hash and stamp == _file_stamp(target_file, hash):
+            print(f"File {target_file} verified by a previous run, skipping download.")
+            return stamp
 
-    packages = PhoronixDownloadDefinition.from_json(PACKAGES_JSON_FILENAME)
+        if _verify_existing_file(package, target_file, hash_name, hash):
+            print(f"File {target_file} verified, skipping download.")
+            return _file_stamp(target_file, hash) if hash else None
 
-    for package in packages:
-        hash = package.md5 or package.sha256
-        hash_fn = md5 if package.md5 else sha256 if package.sha256 else None
+        st = stat(target_file)
+        # Other links (e.g. the download cache) would see the appended data: only resume files of our own
+        if package.size and st.st_size < package.size and st.st_nlink == 1:
+            print(f"Keeping partial file {target_file} to resume its download.")
+        else:
+            print(f"Deleting non-verified file: {target_file}")
+            remove(target_file)
+
+    cache_file = _cache_path(hash_name, hash) if hash else None
+    if cache_file and _link_from_cache(cache_file, target_file, hash_name, hash):
+        print(f"File {target_file} found in the download cache, skipping download.")
+        return _file_stamp(target_file, hash)
+
+    for url in package.urls:
+        print(url)
+        try:
+            verified = _download_and_verify(package, url, target_file, hash_name, hash, prog_bar)
+        except Exception:
+            print_exc()
+            continue
 
-        if package.platform and package.platform != platform:
-            print(f"Skipping {package}, not required for platform {platform}.")
+        if not verified:
             continue
 
-        print(f"Downloading {package}")
+        if cache_file:
+            _store_in_cache(target_file, cache_file)
+        return _file_stamp(target_file, hash) if hash else None
 
-        target_file = package.filename
+    raise Exception(f"Could not download {package} from any of specified URLs")
 
-        if isfile(target_file):
-            with open(target_file, "rb") as f:
-                if (hash and hash_fn(f.read()).hexdigest() == hash) or getsize(
-                    target_file
-                ) == package.size:
-                    print(f"File {target_file} verified, skipping download.")
-                    continue
 
-                print(f"Deleting non-verified file: {target_file}")
-                remove(target_file)
+def download_packages():
+    """
+    A function which downloads the required software as described by get_download_packages().
+    It verifies the checksums afterwards.
+    Packages are downloaded concurrently, sharing a single HTTP session (see http_session()).
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    from json import dump, load
+    from os.path import exists
 
-        downloaded = False
-        for url in package.urls:
-            print(url)
+    if not exists(PACKAGES_JSON_FILENAME):
+        return
+
+    packages = []
+    for package in PhoronixDownloadDefinition.from_json(PACKAGES_JSON_FILENAME):
+        if package.platform and package.platform != _PLATFORM:
+            print(f"Skipping {package}, not required for platform {_PLATFORM}.")
+            continue
+        packages.append(package)
+
+    if not packages:
+        return
+
+    stamps = {}
+    if exists(VERIFIED_JSON_FILENAME):
+        try:
+            with open(VERIFIED_JSON_FILENAME, "r") as file:
+                stamps = load(file)
+        except ValueError:
+            pass
+
+    # progressbar isn't thread-safe: only draw it when a single download is running,
+    # and only on a terminal (it draws on stderr), not into CI logs
+    prog_bar = None if len(packages) == 1 and sys.stderr.isatty() else SilentProgressBar()
+
+    with ThreadPoolExecutor(max_workers=min(MAX_PARALLEL_DOWNLOADS, len(packages))) as pool:
+        futures = {
+            pool.submit(download_package, package, prog_bar=prog_bar, stamp=stamps.get(package.filename)): package
+            for package in packages
+        }
+        errors = []
+        for future in as_completed(futures):
+            filename = futures[future].filename
             try:
-                download_file(url=url, target_filename=target_file)
-            except Exception:
-                print_exc()
-                continue
-
-            if hash:
-                actual_hash = hash_fn(open(target_file, "rb").read()).hexdigest()
-                verified = actual_hash == hash
-                if not verified:
-                    print(
-                        f"Got wrong checksum downloading {package} from {url}, "
-                        f"download hash: {actual_hash}"
-                    )
-            elif package.size:
-                print("No hash specified, checking file size instead.")
-                actual_size = getsize(target_file)
-                verified = actual_size == package.size
-                if not verified:
-                    print(
-                        f"Got wrong filesize downloading {package} from {url}, "
-                        f"download_size={actual_size}"
-                    )
+                stamp = future.result()
+            except Exception as e:
+                errors.append(e)
+                stamp = None
+            if stamp:
+                stamps[filename] = stamp
             else:
-                print(
-                    "WARN: No verification method available for package!\n"
-                    f"Verification skipped for {target_file}"
-                )
-                verified = True
-
-            if not verified:
-                print(f"File {target_file} will now be removed.")
-                remove(target_file)
-                continue
-
-            downloaded = True
-            break
+                stamps.pop(filename, None)
+
+    # Record what was verified even if some package failed, so that the next run doesn't hash it again
+    with open(VERIFIED_JSON_FILENAME, "w") as file:
+        dump(stamps, file)
 
-        if not downloaded:
-            raise Exception(f"Could not download {package} from any of specified URLs")
+    if errors:
+        raise errors[0]
 
 
 if __name__ == "__main__":
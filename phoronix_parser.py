@@ -1,20 +1,30 @@
 #!/usr/bin/env python3
 
 from __future__ import annotations
-import git
+from dataclasses import asdict, dataclass, field
 import os
-import glob
-from xml.dom import minidom
-from shutil import copy2 as cp
-from contextlib import contextmanager, suppress
+import re
+import sys
+from shutil import copyfile, copymode
+from contextlib import suppress
+from functools import lru_cache
 import json
-import fileinput
-
 
 from phoronix_downloader import PACKAGES_JSON_FILENAME, PhoronixDownloadDefinition
 
+try:
+    from orjson import dumps as _dumps
+except ImportError:  # orjson is optional: the standard library encodes the same compact documents, only slower
+
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode()
+
 REMOTE_BENCH_ROOT_PATH = os.path.join("pts")
 REMOTE_BENCH_LICENSE_PATH = "LICENSE"
+BENCH_INDEX_FILENAME = ".bench_index.json"
+# Bumped whenever the structure of the persisted index changes
+BENCH_INDEX_FORMAT = 4
+remote_url = "https://github.com/phoronix-test-suite/test-profiles"
 file_dir = os.path.dirname(os.path.abspath(__file__))
 clone_dir = os.path.join(file_dir, "phoronix-benchs")
 bench_root_path = os.path.join(clone_dir, REMOTE_BENCH_ROOT_PATH)
@@ -28,106 +38,216 @@ installer_map = {
     "darwin": "install_macosx.sh",
     "windows": "install_windows.sh",
 }
-bench_dict = {}
+_PLATFORM = sys.platform
+# <name>-<version> directories of bench_root_path, the version always starts with a digit
+_BENCH_RE = re.compile(r"^(?P<name>.+)-(?P<v>[0-9][0-9A-Za-z._-]*)$")
+_PLATFORM_INSTALLER = installer_map.get(_PLATFORM)
+# dataclass(slots=True) is only available from Python 3.10 onwards
+_DATACLASS_SLOTS = {"slots": True} if sys.version_info >= (3, 10) else {}
+
+
+@dataclass(**_DATACLASS_SLOTS)
+class BenchInfo:
+    """
+    The versions of a benchmark available in the local clone.
+    """
+
+    # version: [platforms]
+    versions: dict[str, list[str]] = field(default_factory=dict)
+    # version: [install*.sh filenames]
+    installers: dict[str, list[str]] = field(default_factory=dict)
+    # The highest of versions, compared numerically (1.10.0 > 1.2.0)
+    latest: str = ""
 
 
-@contextmanager
-def pipe():
-    r, w = os.pipe()
-    yield r, w
-    os.close(r)
-    os.close(w)
+def _version_key(version):
+    """
+    Sort key comparing versions by their numeric components first.
+    """
+    return tuple(int(n) for n in re.findall(r"\d+", version)), version
 
 
-def generate_dict():
-    for bench in sorted(os.listdir(bench_root_path)):
-        bench_name, bench_v = bench.rsplit("-", 1)
+def _scan_bench_dict():
+    """
+    Build the index of the local phoronix definitions by scanning bench_root_path.
+    """
+    from collections import defaultdict
+
+    # BenchInfo() is only built for new names, unlike with setdefault()
+    bench_dict = defaultdict(BenchInfo)
+
+    with os.scandir(bench_root_path) as it:
+        benches = sorted((entry for entry in it if entry.is_dir()), key=lambda entry: entry.name)
+
+    for bench in benches:
+        match = _BENCH_RE.match(bench.name)
+        if not match:
+            # Not named like a benchmark definition
+            continue
+        bench_name, bench_v = match["name"], match["v"]
+        bench_info = bench_dict[bench_name]
+
+        # A single directory read per benchmark, instead of a stat() per installer
+        with os.scandir(bench.path) as it:
+            installers = sorted(
+                entry.name
+                for entry in it
+                if entry.name.startswith("install") and entry.name.endswith(".sh") and entry.is_file()
+            )
+        if installers:
+            bench_info.installers[bench_v] = installers
 
-        if bench_name not in bench_dict:
-            bench_dict[bench_name] = {}
+        platforms = [p for p, installer_name in installer_map.items() if installer_name in installers]
+        if platforms:
+            bench_info.versions[bench_v] = platforms
 
-        for p, installer_name in installer_map.items():
-            if os.path.isfile(os.path.join(bench_root_path, bench, installer_name)):
-                if "versions" not in bench_dict[bench_name]:
-                    bench_dict[bench_name]["versions"] = {}
+    for bench_info in bench_dict.values():
+        bench_info.latest = max(bench_info.versions, key=_version_key, default="")
 
-                if bench_v in bench_dict[bench_name]["versions"]:
-                    bench_dict[bench_name]["versions"][bench_v].append(p)
-                else:
-                    bench_dict[bench_name]["versions"][bench_v] = [p]
+    # A plain dict again, so that looking up a missing benchmark doesn't add it
+    return dict(bench_dict)
 
 
-def phoronix_init():
+def _clone_head():
     """
-    Function responsible of cloning and syncing the local clone of phoronix definitions.
-    This function is idempotent.
+    The commit the local clone is checked out at, None if it can't be determined.
+    The refs are read straight from the .git directory, so that looking a benchmark up
+    doesn't require spawning git.
     """
-    if not os.path.isdir(clone_dir):
-        os.mkdir(clone_dir)
+    from os.path import join
 
-    repo = git.Repo.init(clone_dir)
+    git_dir = join(clone_dir, ".git")
+    with suppress(OSError):
+        with open(join(git_dir, "HEAD"), "r") as file:
+            head = file.read().strip()
+        if not head.startswith("ref: "):
+            return head  # detached HEAD
+        ref = head[len("ref: "):]
+        with suppress(OSError):
+            with open(join(git_dir, ref), "r") as file:
+                return file.read().strip()
+        with open(join(git_dir, "packed-refs"), "r") as file:
+            for line in file:
+                sha, _, name = line.strip().partition(" ")
+                if name == ref:
+                    return sha
+    return None
+
+
+@lru_cache(maxsize=1)
+def _bench_dict():
+    """
+    Index of the local phoronix definitions, in the form {name: BenchInfo}.
+    The index is persisted in BENCH_INDEX_FILENAME under the .git directory of the clone, where it doesn't show up
+    as an untracked file. It is keyed by the commit it was built from and by the mtime of bench_root_path,
+    so that the definitions are only scanned again after a sync
+    (or a local edit adding or removing benchmarks) actually changed them.
+    The result is also cached in memory, phoronix_init() invalidates it after a sync.
+    """
+    head = _clone_head()
+    index_path = os.path.join(clone_dir, ".git", BENCH_INDEX_FILENAME)
+    mtime = None
+    with suppress(OSError):
+        mtime = os.stat(bench_root_path).st_mtime_ns
+
+    if head:
+        with suppress(OSError, ValueError, KeyError):
+            with open(index_path, "r") as file:
+                index = json.load(file)
+            if index["sha"] == head and index["mtime"] == mtime and index["format"] == BENCH_INDEX_FORMAT:
+                return {name: BenchInfo(**bench_info) for name, bench_info in index["dict"].items()}
+
+    bench_dict = _scan_bench_dict()
+
+    if head:
+        with suppress(OSError):
+            with open(index_path, "w") as file:
+                json.dump(
+                    {
+                        "sha": head,
+                        "mtime": mtime,
+                        "format": BENCH_INDEX_FORMAT,
+                        "dict": {name: asdict(bench_info) for name, bench_info in bench_dict.items()},
+                    },
+                    file,
+                )
 
-    try:
-        repo.create_remote(
-            "origin", "https://github.com/phoronix-test-suite/test-profiles"
-        )
-    except git.exc.GitCommandError:
-        print("Origin already set up.")
+    return bench_dict
 
-    repo.config_writer().set_value("core", "sparsecheckout", "true").release()
 
-    sparse_checkout_info_file_path = os.path.join(
-        clone_dir, ".git", "info", "sparse-checkout"
-    )
+def run_git(*args):
+    """
+    Run the git CLI with args, raising an exception if it fails.
+    """
+    import subprocess
+
+    subprocess.run(["git", *args], check=True)
+
 
-    print(sparse_checkout_info_file_path)
-    if os.path.isfile(sparse_checkout_info_file_path):
-        sparse_checkout_info_file = open(sparse_checkout_info_file_path, "w")
+def phoronix_init():
+    """
+    Function responsible of cloning and syncing the local clone of phoronix definitions.
+    This function is idempotent.
+    The clone is shallow, blob-less and sparse: only the tip of master is fetched, and only the
+    files below REMOTE_BENCH_ROOT_PATH (plus the top-level ones, such as the license) are ever downloaded
+    and checked out.
+    """
+    if not os.path.isdir(os.path.join(clone_dir, ".git")):
+        run_git(
+            "clone",
+            "--depth=1",
+            "--filter=blob:none",
+            "--sparse",
+            "--no-checkout",
+            "--single-branch",
+            "--branch=master",
+            remote_url,
+            clone_dir,
+        )
+        # Only check out once the sparse patterns are set, so that no other blob is ever fetched
+        # Cone mode matches whole directories, and always includes the top-level files (hence the license)
+        run_git("-C", clone_dir, "sparse-checkout", "set", "--cone", REMOTE_BENCH_ROOT_PATH)
+        run_git("-C", clone_dir, "checkout", "master")
     else:
-        sparse_checkout_info_file = open(sparse_checkout_info_file_path, "x")
-    sparse_checkout_info_file.write(f"{REMOTE_BENCH_ROOT_PATH}\n")
-    sparse_checkout_info_file.write(f"{REMOTE_BENCH_LICENSE_PATH}\n")
-    sparse_checkout_info_file.close()
+        print("Origin already set up.")
+        run_git("-C", clone_dir, "fetch", "--depth=1", "origin", "master")
+        run_git("-C", clone_dir, "reset", "--hard", "origin/master")
 
-    rebase = False
-    try:
-        repo.git.reset("--hard", "origin/master")
-        rebase = True
-    except Exception:
-        print("Nothing to reset")
+    _bench_dict.cache_clear()
+    _bench_by_platform.cache_clear()
 
-    repo.remotes.origin.pull("master", rebase=rebase)
+
+@lru_cache(maxsize=None)
+def _bench_by_platform(plat):
+    """
+    The view of _bench_dict() restricted to plat, in the form {name: [versions]}.
+    Benchmarks without any version for plat are left out.
+    """
+    bench_by_platform = {}
+    for bench_name, bench_info in _bench_dict().items():
+        versions = [v for v, platforms in bench_info.versions.items() if plat in platforms]
+        if versions:
+            bench_by_platform[bench_name] = versions
+    return bench_by_platform
 
 
 def phoronix_list(benchmark_name=None, plat=None):
     """
     Function capable of listing all the versions of a given benchmark.
     """
-    from sys import platform
-
     if plat is None:
-        plat = platform
+        plat = _PLATFORM
+    bench_by_platform = _bench_by_platform(plat)
     if benchmark_name is None or not benchmark_name:
-        if not bench_dict:
-            generate_dict()
-        for bench_name, bench_data in bench_dict.items():
-            for v, p in bench_data["versions"].items():
-                if plat in p:
-                    print(f"{bench_name} @ {v} [{plat}]")
+        for bench_name, versions in bench_by_platform.items():
+            for v in versions:
+                print(f"{bench_name} @ {v} [{plat}]")
     else:
-        local_benchmark_repo = os.path.join(
-            clone_dir, REMOTE_BENCH_ROOT_PATH, benchmark_name
-        )
-        results = glob.glob(os.path.join(bench_root_path, local_benchmark_repo + "*"))
-        if results:
-            if not bench_dict:
-                generate_dict()
-            for v, p in bench_dict[benchmark_name]["versions"].items():
-                if plat in p:
-                    print(f"{benchmark_name} @ {v} [{plat}]")
+        if benchmark_name in _bench_dict():
+            for v in bench_by_platform.get(benchmark_name, []):
+                print(f"{benchmark_name} @ {v} [{plat}]")
         else:
             raise Exception("Benchmark {} not found.".format(benchmark_name))
-    pass
 
 
 def phoronix_exists(benchmark_name, benchmark_v=None):
@@ -135,11 +255,10 @@ def phoronix_exists(benchmark_name, benchmark_v=None):
     Function returning a boolean flag relative to existence of a given bench (with optional version).
     """
     if benchmark_name:
-        if not bench_dict:
-            generate_dict()
+        bench_dict = _bench_dict()
         if benchmark_name in bench_dict:
             if benchmark_v:
-                return benchmark_v in bench_dict[benchmark_name]["versions"]
+                return benchmark_v in bench_dict[benchmark_name].versions
             else:
                 return True
         else:
@@ -152,23 +271,120 @@ def safe_mkdir(path):
     """
     An mkdir wrapper to avoid calling mkdir on existing directorires.
     """
-    if not os.path.isdir(path):
-        os.mkdir(path)
+    os.makedirs(path, exist_ok=True)
+
+
+def iter_elements(path, *tags):
+    """
+    Stream the elements named after any of tags out of the XML file at path, in document order.
+    Each element is detached from the tree once the caller is done with it, so memory usage doesn't
+    grow with the size of the file.
+    """
+    try:
+        from lxml import etree
+    except ImportError:  # lxml is optional: the ElementTree API is all we use
+        import xml.etree.ElementTree as etree
+    else:
+        # lxml matches the tags in C: only the elements of interest ever reach Python
+        for _, element in etree.iterparse(path, events=("end",), tag=tags):
+            yield element
+            element.clear(keep_tail=True)
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+        return
+
+    parents = []
+    for event, element in etree.iterparse(path, events=("start", "end")):
+        if event == "start":
+            parents.append(element)
+            continue
+
+        parents.pop()
+        if element.tag in tags:
+            yield element
+            if parents:
+                parents[-1].remove(element)
+
+
+@dataclass
+class TestInfo:
+    """
+    Everything a conversion needs from the test-definition.xml and results-definition.xml of a benchmark.
+    """
+
+    title: str
+    description: str
+    # (preset name, CLI args) for each <Entry>
+    entries: list[tuple[str, str]]
+    # (stat name, output template) for each <ResultsParser> or <SystemMonitor>
+    result_parsers: list[tuple[str, str]]
+
+
+def _parse_test_defs(bench_path) -> TestInfo:
+    """
+    Parse the test and results definitions of a benchmark exactly once, extracting all the needed pieces.
+    Both files are walked a single time, dispatching on the tag of each element of interest.
+    The parses are cached per path and mtime, so converting the same benchmark again doesn't parse
+    the files again, while a sync which changes them is picked up.
+    """
+    from os.path import join
+
+    test_path = join(bench_path, "test-definition.xml")
+    results_path = join(bench_path, "results-definition.xml")
+    title, description, entries = _extract_test_info(test_path, os.stat(test_path).st_mtime_ns)
+
+    return TestInfo(
+        title=title,
+        description=description,
+        entries=list(entries),
+        result_parsers=list(_extract_results(results_path, os.stat(results_path).st_mtime_ns)),
+    )
+
+
+@lru_cache(maxsize=64)
+def _extract_test_info(test_path, mtime) -> tuple[str, str, tuple[tuple[str, str], ...]]:
+    """
+    The title, the description and the (preset name, CLI args) pairs of a test-definition.xml.
+    mtime is only part of the cache key.
+    """
+    title = description = None
+    entries = []
+    # Streamed, test-definition.xml is never fully materialized in memory
+    for element in iter_elements(test_path, "TestInformation", "Entry"):
+        if element.tag == "Entry":
+            entries.append((element.findtext("Name", "").lower(), element.findtext("Value", "")))
+        elif title is None:
+            title = element.findtext("Title")
+            description = element.findtext("Description")
+
+    return title, description, tuple(entries)
 
 
-def file_inplace_replace(file_path, search_string, replace_string):
+@lru_cache(maxsize=64)
+def _extract_results(results_path, mtime) -> tuple[tuple[str, str], ...]:
     """
-    A function working very much as replace, but inplace on files.
+    The (stat name, output template) pairs of a results-definition.xml, in document order.
+    mtime is only part of the cache key.
     """
-    with fileinput.FileInput(file_path, inplace=True) as file:
-        for line in file:
-            print(line.replace(search_string, replace_string), end="")
+    results_parsers = []
+    system_monitors = []
+    for element in iter_elements(results_path, "ResultsParser", "SystemMonitor"):
+        if element.tag == "ResultsParser":
+            results_parsers.append(
+                (element.findtext("ArgumentsDescription") or "results", element.findtext("OutputTemplate"))
+            )
+        else:
+            system_monitors.append(("results", element.findtext("Sensor")))
 
+    # <SystemMonitor> nodes are only taken into account when no <ResultsParser> is defined
+    return tuple(results_parsers or system_monitors)
 
-def convert_settings(settings_list, settings_dir):
+
+def convert_settings(entries, settings_dir):
     """
-    Function which parses phoronix-defined CLI args converting them into json setting files.
-    It iterates over a list of XML elements in the form (extracted from a test-definition.xml):
+    Function which converts phoronix-defined CLI args into json setting files.
+    It iterates over the (name, args) pairs extracted by _parse_test_defs() from the <Entry>
+    elements of a test-definition.xml, in the form:
 
     <Entry>
         <Name>Fast</Name>
@@ -188,90 +404,74 @@ def convert_settings(settings_list, settings_dir):
     </Entry>
 
     """
-    default_settings_file = ""
-    save_default_settings = True
+    from os.path import join
 
     safe_mkdir(settings_dir)
-    if len(settings_list) == 0:
-        name = "unique_preset"
-        args = "no_setting_specified"
-        dict = {"args": args}
-
-        with open(os.path.join(settings_dir, f"preset-{name}.json"), "w+") as outfile:
-            json.dump(dict, outfile)
-            if save_default_settings:
-                default_settings_file = f"preset-{name}.json"
-                save_default_settings = False
-    else:
-        for setting in settings_list:
-            if len(setting.getElementsByTagName("Name")) != 0:
-                name = setting.getElementsByTagName("Name")[
-                    0
-                ].firstChild.nodeValue.lower()
-            if len(setting.getElementsByTagName("Value")) != 0:
-                args = setting.getElementsByTagName("Value")[0].firstChild.nodeValue
-
-            dict = {"args": args}
-            with open(
-                os.path.join(settings_dir, f"preset-{name}.json"), "w+"
-            ) as outfile:
-                json.dump(dict, outfile)
-                if save_default_settings:
-                    default_settings_file = f"preset-{name}.json"
-                    save_default_settings = False
+    if len(entries) == 0:
+        entries = [("unique_preset", "no_setting_specified")]
+
+    # The first preset is the default one
+    default_settings_file = f"preset-{entries[0][0]}.json"
+
+    for name, args in entries:
+        # Tiny files: skip the buffered io stack and write the encoded JSON with a single syscall
+        fd = os.open(join(settings_dir, f"preset-{name}.json"), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.write(fd, _dumps({"args": args}))
+        finally:
+            os.close(fd)
 
     return default_settings_file
 
 
-def install_installers(bench_path, target_dir):
+def install_installers(bench_path, target_dir, phoronix_filenames):
     """
     A function which copies and chmod+x the installer scripts coming with phoronix benchmarks.
     Typical names are install.sh, install_macosx.sh, install_windows.sh .
+    phoronix_filenames is the list of installers of the benchmark, as recorded in _bench_dict().
     """
-    from os.path import basename, join
-
-    phoronix_filenames = []
-    for installer in glob.glob(os.path.join(bench_path, "install*.sh")):
-        phoronix_filenames.append(basename(installer))
-        cp(installer, target_dir)
-        installer_path = os.path.join(target_dir, basename(installer))
-        ensure_executable(installer_path)
+    from os.path import join
 
-    cp(join(clone_dir, REMOTE_BENCH_LICENSE_PATH), target_dir)
-    if not phoronix_filenames:
-        return
+    for filename in phoronix_filenames:
+        target = copy_file(join(bench_path, filename), join(target_dir, filename))
+        ensure_executable(target)
 
-    with open(join(target_dir, REMOTE_BENCH_LICENSE_PATH), "r+") as file:
+    # The license is written in one go, instead of being copied and then rewritten in place
+    with open(join(clone_dir, REMOTE_BENCH_LICENSE_PATH), "r") as file:
         content = file.read()
-        file.seek(0)
-        file.write("ONLY THE FOLLOWING FILES ARE DISTRIBUTED UNDER THIS LICENSE:\n")
-        for filename in phoronix_filenames:
-            file.write(f"* {filename}\n")
-        file.write("\n" + content)
+
+    with open(join(target_dir, REMOTE_BENCH_LICENSE_PATH), "w") as file:
+        if phoronix_filenames:
+            file.write("ONLY THE FOLLOWING FILES ARE DISTRIBUTED UNDER THIS LICENSE:\n")
+            for filename in phoronix_filenames:
+                file.write(f"* {filename}\n")
+            file.write("\n")
+        file.write(content)
+
+
+@lru_cache(maxsize=None)
+def _read_template(template_path) -> str:
+    """
+    The content of a template file, read from disk only the first time it is needed.
+    """
+    with open(template_path, "r") as file:
+        return file.read()
 
 
 def create_setup_file(target_dir, benchmark_name):
     """
     A function which creates a setup file from a template.
     """
-    from os import chmod, stat
-    from stat import S_IEXEC
-
     target_setup_file = os.path.join(target_dir, "setup.sh")
-    cp(setup_template, target_setup_file)
-    file_stat = stat(target_setup_file)
-    chmod(target_setup_file, file_stat.st_mode | S_IEXEC)
-    file_inplace_replace(
-        file_path=target_setup_file,
-        search_string="BENCHMARK_NAME",
-        replace_string=benchmark_name,
-    )
+    # A plain token rather than string.Template: the template is a shell script, where $ is common
+    with open(target_setup_file, "w") as file:
+        file.write(_read_template(setup_template).replace("BENCHMARK_NAME", benchmark_name))
+    ensure_executable(target_setup_file)
 
 
 def create_info_file(
     target_dir,
-    test_definition_xml,
-    results_definition_xml,
+    test_info: TestInfo,
     default_settings_file,
     benchmark_name,
 ):
@@ -281,46 +481,13 @@ def create_info_file(
     Title and Description are the sensitive tokens.
     Furthermore, this function takes informations from results-definition.xml about benchamrk results
     parsing in order to put them inside the benchmark.json file.
+    Both XML files have already been parsed into test_info by _parse_test_defs().
     """
-    from sys import platform
-
-    info_section = test_definition_xml.getElementsByTagName("TestInformation")[0]
-    info_benchmark_name = info_section.getElementsByTagName("Title")[
-        0
-    ].firstChild.nodeValue
-    info_benchmark_description = info_section.getElementsByTagName("Description")[
-        0
-    ].firstChild.nodeValue
+    info_benchmark_name = test_info.title
+    info_benchmark_description = test_info.description
     benchmark_run_command = "./" + benchmark_name
 
     target_benchmark_info_file = os.path.join(target_dir, "benchmark.json")
-    cp(benchmark_info_template, target_benchmark_info_file)
-
-    file_inplace_replace(
-        file_path=target_benchmark_info_file,
-        search_string="PUT_NAME_HERE",
-        replace_string=info_benchmark_name,
-    )
-    file_inplace_replace(
-        file_path=target_benchmark_info_file,
-        search_string="PUT_DESCRIPTION_HERE",
-        replace_string=info_benchmark_description,
-    )
-    file_inplace_replace(
-        file_path=target_benchmark_info_file,
-        search_string="PUT_DEFAULT_PRESETS_HERE",
-        replace_string=default_settings_file,
-    )
-    file_inplace_replace(
-        file_path=target_benchmark_info_file,
-        search_string="PUT_RUN_COMMAND_HERE",
-        replace_string=benchmark_run_command,
-    )
-    file_inplace_replace(
-        target_benchmark_info_file,
-        "@INSTALLER_FILENAME@",
-        f"./{installer_map[platform]}",
-    )
 
     # RESULTS PARSING
     # Results can be represented with two different tag inside the results-definition.xml,
@@ -328,41 +495,26 @@ def create_info_file(
 
     regex = "(.*)"
 
-    if len(results_definition_xml.getElementsByTagName("ResultsParser")) != 0:
-        results_parser = results_definition_xml.getElementsByTagName("ResultsParser")
-        results_dict = {}  # dict when I put all the statistics to parse
-        for node in results_parser:
-            stat = node.getElementsByTagName("OutputTemplate")[0].firstChild.nodeValue
-            if len(node.getElementsByTagName("ArgumentsDescription")) != 0:
-                stat_name = node.getElementsByTagName("ArgumentsDescription")[
-                    0
-                ].firstChild.nodeValue
-            else:
-                stat_name = "results"
+    results_dict = {
+        stat_name: {"regex": stat.replace("#_RESULT_#", regex)}
+        for stat_name, stat in test_info.result_parsers
+    }
 
-            stat = stat.replace("#_RESULT_#", regex)
-            mini_dict = {}
-            mini_dict["regex"] = stat
-            results_dict[stat_name] = mini_dict
-            results_string = json.dumps(results_dict)
-    else:
-        results_parser = results_definition_xml.getElementsByTagName("SystemMonitor")
-        results_dict = {}  # dict when I put all the statistics to parse
-        for node in results_parser:
-            stat = node.getElementsByTagName("Sensor")[0].firstChild.nodeValue
-            stat_name = "results"
-
-            stat = stat.replace("#_RESULT_#", regex)
-            mini_dict = {}
-            mini_dict["regex"] = stat
-            results_dict[stat_name] = mini_dict
-            results_string = json.dumps(results_dict)
-
-    file_inplace_replace(
-        file_path=target_benchmark_info_file,
-        search_string="PUT_STATS_HERE",
-        replace_string=results_string,
-    )
+    # The template is loaded as JSON and dumped back, so that values get properly escaped
+    benchmark_info = json.loads(_read_template(benchmark_info_template))
+
+    benchmark_info["name"] = info_benchmark_name
+    benchmark_info["description"] = info_benchmark_description
+    benchmark_info["default_preset"] = default_settings_file
+    benchmark_info["run_command"] = benchmark_run_command
+    benchmark_info["setup_command"] = [
+        f"./{_PLATFORM_INSTALLER}" if command == "@INSTALLER_FILENAME@" else command
+        for command in benchmark_info["setup_command"]
+    ]
+    benchmark_info["stats"] = results_dict
+
+    with open(target_benchmark_info_file, "w") as file:
+        json.dump(benchmark_info, file, indent=4)
 
 
 def get_related_platform(xml_package):
@@ -371,10 +523,8 @@ def get_related_platform(xml_package):
     """
     related_platform = None
 
-    if xml_package.getElementsByTagName("PlatformSpecific"):
-        platform_string = xml_package.getElementsByTagName("PlatformSpecific")[
-            0
-        ].firstChild.nodeValue
+    platform_string = xml_package.findtext("PlatformSpecific")
+    if platform_string:
         platform_string = platform_string.lower()
 
         if "linux" in platform_string:
@@ -412,28 +562,17 @@ def get_download_packages(bench_path) -> list[PhoronixDownloadDefinition]:
 
     downloads = []
     try:
-        downloads_xml = minidom.parse(downloads_xml_path)
-        packages_list = downloads_xml.getElementsByTagName("Package")
-
-        for package in packages_list:
-            urls = package.getElementsByTagName("URL")[0].firstChild.nodeValue.split(
-                ","
-            )
-            filename = package.getElementsByTagName("FileName")[0].firstChild.nodeValue
+        # Streamed: each <Package> is dropped as soon as it has been read
+        for package in iter_elements(downloads_xml_path, "Package"):
+            urls = package.findtext("URL", "").split(",")
+            filename = package.findtext("FileName")
 
             platform = get_related_platform(xml_package=package)
 
-            md5 = None
-            sha256 = None
-            size = None
-            with suppress(IndexError):
-                md5 = package.getElementsByTagName("MD5")[0].firstChild.nodeValue
-            with suppress(IndexError):
-                sha256 = package.getElementsByTagName("SHA256")[0].firstChild.nodeValue
-            with suppress(IndexError):
-                size = int(
-                    package.getElementsByTagName("FileSize")[0].firstChild.nodeValue
-                )
+            md5 = package.findtext("MD5") or None
+            sha256 = package.findtext("SHA256") or None
+            size = package.findtext("FileSize")
+            size = int(size) if size else None
 
             downloads.append(
                 PhoronixDownloadDefinition(filename, platform, urls, size, md5, sha256)
@@ -453,19 +592,38 @@ def create_packages_file(bench_path: str, target_dir: str) -> None:
 
 
 def ensure_executable(path: str) -> None:
-    from os import chmod, stat
-    from stat import S_IEXEC
+    """
+    Mark a generated script as executable. The mode is set outright: the scripts are files we just wrote,
+    so there is no need to stat() them to preserve their previous permissions.
+    """
+    os.chmod(path, 0o755)
+
+
+def copy_file(src, dst):
+    """
+    Copy the content and the mode of src to dst.
+    dst is replaced rather than written through, as it may be a hardlink left by an earlier conversion.
+    """
+    with suppress(FileNotFoundError):
+        os.remove(dst)
 
-    chmod(path, stat(path).st_mode | S_IEXEC)
+    copyfile(src, dst)
+    copymode(src, dst)
+    return dst
 
 
 def phoronix_install(benchmark_name, benchmark_v=None):
+    from concurrent.futures import ThreadPoolExecutor
     from os.path import dirname, join
-    from shutil import copy
+
+    if _PLATFORM_INSTALLER is None:
+        raise Exception(f"Platform {_PLATFORM} is not supported.")
 
     if phoronix_exists(benchmark_name, benchmark_v):
         if not benchmark_v:
-            benchmark_v = list(bench_dict[benchmark_name]["versions"].keys())[-1]
+            benchmark_v = _bench_dict()[benchmark_name].latest
+            if not benchmark_v:
+                raise Exception(f"Benchmark {benchmark_name} has no installable version.")
             print(
                 f"Benchmark version not specified, defaulting to latest ({benchmark_v})"
             )
@@ -475,13 +633,7 @@ def phoronix_install(benchmark_name, benchmark_v=None):
             bench_root_path, "{}-{}".format(benchmark_name, benchmark_v)
         )
 
-        test_definition_xml = minidom.parse(
-            os.path.join(bench_path, "test-definition.xml")
-        )
-        results_definition_xml = minidom.parse(
-            os.path.join(bench_path, "results-definition.xml")
-        )
-        settings_list = test_definition_xml.getElementsByTagName("Entry")
+        test_info = _parse_test_defs(bench_path)
 
         safe_mkdir(install_dir)
 
@@ -493,33 +645,57 @@ def phoronix_install(benchmark_name, benchmark_v=None):
 
         settings_dir = os.path.join(target_dir, "presets")
         default_settings_file = convert_settings(
-            settings_list=settings_list, settings_dir=settings_dir
-        )
-
-        install_installers(bench_path=bench_path, target_dir=target_dir)
-
-        create_setup_file(target_dir=target_dir, benchmark_name=benchmark_name)
-
-        create_info_file(
-            target_dir=target_dir,
-            test_definition_xml=test_definition_xml,
-            results_definition_xml=results_definition_xml,
-            default_settings_file=default_settings_file,
-            benchmark_name=benchmark_name,
+            entries=test_info.entries, settings_dir=settings_dir
         )
 
-        copy(
-            join(dirname(__file__), "phoronix_downloader.py"),
-            join(target_dir, "phoronix_downloader.py"),
-        )
-
-        create_packages_file(bench_path, target_dir)
+        # The remaining steps write distinct files and don't depend on each other: overlap their I/O
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            futures = [
+                pool.submit(
+                    install_installers,
+                    bench_path=bench_path,
+                    target_dir=target_dir,
+                    phoronix_filenames=_bench_dict()[benchmark_name].installers.get(benchmark_v, []),
+                ),
+                pool.submit(create_setup_file, target_dir=target_dir, benchmark_name=benchmark_name),
+                pool.submit(
+                    create_info_file,
+                    target_dir=target_dir,
+                    test_info=test_info,
+                    default_settings_file=default_settings_file,
+                    benchmark_name=benchmark_name,
+                ),
+                pool.submit(
+                    copy_file,
+                    join(dirname(__file__), "phoronix_downloader.py"),
+                    join(target_dir, "phoronix_downloader.py"),
+                ),
+                pool.submit(create_packages_file, bench_path, target_dir),
+            ]
+            for future in futures:
+                future.result()
     else:
         raise Exception(
             f"The required benchmark {benchmark_name} @ {benchmark_v} doesn't exist."
         )
 
 
+def phoronix_install_many(benchmark_names):
+    """
+    Convert the latest version of each of benchmark_names, one benchmark per process.
+    phoronix_init() is expected to have been called already.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    # Build (or load) the index once, so that the workers find it on disk
+    _bench_dict()
+
+    with ProcessPoolExecutor() as pool:
+        futures = [pool.submit(phoronix_install, benchmark_name) for benchmark_name in benchmark_names]
+        for future in as_completed(futures):
+            future.result()
+
+
 if __name__ == "__main__":
     phoronix_init()
     # phoronix_install("astcenc", "1.1.0")